@@ -1,7 +1,13 @@
 import os
 import re
+import hashlib
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
 import pandas as pd
+import xlsxwriter
 from openpyxl import load_workbook
 from datetime import datetime
 from werkzeug.utils import secure_filename
@@ -11,6 +17,7 @@ from flask_cors import CORS
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
+logger = logging.getLogger(__name__)
 
 # File upload configurations
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -24,29 +31,314 @@ def allowed_file(filename):
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DRAFT_TEMPLATE_PATH = os.path.join(BASE_DIR, "Draft Output.xlsx")
-
-def extract_no_faktur_from_description(desc: str) -> str | None:
-    if pd.isna(desc):
+TEMPLATE_DATA_START_ROW = 5  # baris 1-4 template = header
+
+# Engine baca Excel: calamine (Rust) jauh lebih cepat dari openpyxl untuk file input besar.
+# Kalau python-calamine belum ter-install, engine=None: pandas pilih sendiri sesuai ekstensi
+# (openpyxl untuk .xlsx, xlrd untuk .xls).
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Cache hasil parsing file input (per isi file), supaya upload ulang file yang sama
+# tidak perlu parse xlsx lagi. Disimpan maksimal INPUT_CACHE_MAX_FILES file terbaru, dan tiap file
+# dihapus INPUT_CACHE_MAX_AGE detik setelah terakhir dipakai (isinya salinan data pajak yang di-upload).
+INPUT_CACHE_DIR = os.path.join(BASE_DIR, ".cache")
+INPUT_CACHE_MAX_FILES = 20
+INPUT_CACHE_MAX_AGE = 24 * 60 * 60
+# Naikkan kalau cara baca file input (_read_k3 / _read_coretax) berubah, supaya cache lama tidak dipakai
+INPUT_CACHE_VERSION = 1
+
+# Dtype untuk key voucher / No Faktur: string berbasis Arrow (strip/split/hash jalan di C++)
+KEY_DTYPE = "string[pyarrow]"
+
+# Urutan kolom output di template (kiri = K3, kanan = Coretax)
+K3_OUTPUT_COLUMNS = [
+    "Account No.", "Account Name", "Date", "Voucher Category", "Voucher No.", "Description",
+    "Debit Amount", "Credit Amount", "Net", "Direction", "Balance",
+]
+CORETAX_OUTPUT_COLUMNS = [
+    "NO_VOUCHER",   # No Faktur from Coretax
+    "NO_FP_MODIF",  # Voucher No. from NO FP MODIF
+    "DPP", "PPN", "Difference", "Customer",
+    "Keterangan (Digunggung/Tidak Digunngung)",
+]
+# Kolom output yang berisi angka: NaN ditulis sebagai cell kosong, bukan "-"
+NUMERIC_OUTPUT_COLUMNS = {"Debit Amount", "Credit Amount", "Net", "Balance", "DPP", "PPN", "Difference"}
+
+# Mapping style openpyxl (template) -> opsi format xlsxwriter
+_THEME_COLORS = {0: "#FFFFFF", 1: "#000000"}  # background1 / text1 di theme default Office
+_H_ALIGN = {
+    "centerContinuous": "center_across", "center": "center", "left": "left", "right": "right",
+    "fill": "fill", "justify": "justify", "distributed": "distributed",
+}
+_V_ALIGN = {"top": "top", "center": "vcenter", "bottom": "bottom", "justify": "vjustify", "distributed": "vdistributed"}
+_BORDER_STYLES = {
+    "thin": 1, "medium": 2, "dashed": 3, "dotted": 4, "thick": 5, "double": 6, "hair": 7,
+    "mediumDashed": 8, "dashDot": 9, "mediumDashDot": 10, "dashDotDot": 11,
+    "mediumDashDotDot": 12, "slantDashDot": 13,
+}
+
+def _xlsx_color(color):
+    if color is None:
         return None
-    s = str(desc).strip()
-    parts = [p.strip() for p in s.split("/")]
-    # "slash ke-2" = index 1 (setelah slash pertama)
-    return parts[1] if len(parts) >= 2 and parts[1] else None
+    if color.type == "rgb" and isinstance(color.rgb, str):
+        return "#" + color.rgb[-6:]
+    if color.type == "theme":
+        return _THEME_COLORS.get(color.theme)
+    return None
+
+def _xlsx_format_props(cell) -> dict:
+    """Terjemahkan style satu cell openpyxl jadi dict properti format xlsxwriter."""
+    props = {}
+    font = cell.font
+    if font.name:
+        props["font_name"] = font.name
+    if font.sz:
+        props["font_size"] = font.sz
+    if font.b:
+        props["bold"] = True
+    if font.i:
+        props["italic"] = True
+    if font.u:
+        props["underline"] = 1
+    if _xlsx_color(font.color):
+        props["font_color"] = _xlsx_color(font.color)
+
+    if cell.fill.fill_type == "solid" and _xlsx_color(cell.fill.fgColor):
+        props["pattern"] = 1
+        props["bg_color"] = _xlsx_color(cell.fill.fgColor)
+
+    for side in ("left", "right", "top", "bottom"):
+        border = getattr(cell.border, side)
+        if border is not None and border.style in _BORDER_STYLES:
+            props[side] = _BORDER_STYLES[border.style]
+            if _xlsx_color(border.color):
+                props[f"{side}_color"] = _xlsx_color(border.color)
+
+    if cell.alignment.horizontal in _H_ALIGN:
+        props["align"] = _H_ALIGN[cell.alignment.horizontal]
+    if cell.alignment.vertical in _V_ALIGN:
+        props["valign"] = _V_ALIGN[cell.alignment.vertical]
+    if cell.alignment.wrap_text:
+        props["text_wrap"] = True
+
+    if cell.number_format and cell.number_format != "General":
+        props["num_format"] = cell.number_format
+    return props
+
+@lru_cache(maxsize=1)
+def _template_layout(mtime: float) -> dict:
+    """
+    Snapshot bagian template Draft Output.xlsx yang dipakai writer: judul sheet, lebar kolom,
+    tinggi baris, dan cell header (baris sebelum TEMPLATE_DATA_START_ROW) beserta formatnya.
+    Template cuma di-parse sekali; mtime jadi key supaya template yang diedit tetap kebaca.
+    """
+    ws = load_workbook(DRAFT_TEMPLATE_PATH).active
+    styles, style_index, cells = [], {}, []
+
+    def style_of(obj):
+        # Index format di `styles` (cell / kolom / baris dengan style_id yang sama berbagi 1 format)
+        if not obj.has_style:
+            return None
+        if obj.style_id not in style_index:
+            style_index[obj.style_id] = len(styles)
+            styles.append(_xlsx_format_props(obj))
+        return style_index[obj.style_id]
+
+    for row in ws.iter_rows(min_row=1, max_row=TEMPLATE_DATA_START_ROW - 1):
+        for cell in row:
+            cells.append((cell.row - 1, cell.column - 1, cell.value, style_of(cell)))
+
+    # Style level kolom (mis. kolom L pemisah = fill hitam sampai bawah) & level baris header ikut disalin
+    widths = [
+        (d.min - 1, d.max - 1, d.width, style_of(d))
+        for d in ws.column_dimensions.values() if d.width or d.has_style
+    ]
+    heights = {
+        r - 1: (d.height, style_of(d))
+        for r, d in ws.row_dimensions.items()
+        if r < TEMPLATE_DATA_START_ROW and (d.height or d.has_style)
+    }
+    return {
+        "title": ws.title,
+        "widths": widths,
+        "heights": heights,
+        "styles": styles,
+        "cells": cells,
+    }
 
+# Parse template sekali saat app start, supaya request pertama tidak kena biaya parse
+if os.path.exists(DRAFT_TEMPLATE_PATH):
+    _template_layout(os.path.getmtime(DRAFT_TEMPLATE_PATH))
+
+def _output_header_labels(layout: dict) -> list:
+    """
+    Label header template (baris ke-4) untuk tiap kolom output, tanpa kolom pemisah.
+    Label dobel diberi akhiran ".1", ".2", ... sama seperti read_excel (mis. "Voucher No..1").
+    """
+    header_row = TEMPLATE_DATA_START_ROW - 2
+    labels_by_col = {c: value for r, c, value, _ in layout["cells"] if r == header_row and value is not None}
+    positions = list(range(len(K3_OUTPUT_COLUMNS))) + [
+        len(K3_OUTPUT_COLUMNS) + 1 + i for i in range(len(CORETAX_OUTPUT_COLUMNS))
+    ]
+
+    labels, seen = [], {}
+    for column, pos in zip(K3_OUTPUT_COLUMNS + CORETAX_OUTPUT_COLUMNS, positions):
+        label = str(labels_by_col.get(pos, column))
+        count = seen.get(label, 0)
+        seen[label] = count + 1
+        labels.append(f"{label}.{count}" if count else label)
+    return labels
+
+def _write_draft_output(out_path: str, layout: dict, rows) -> None:
+    """
+    Tulis file output pakai xlsxwriter (constant_memory, baris langsung di-stream ke file).
+    Header + lebar kolom diambil dari snapshot template (_template_layout), data mulai TEMPLATE_DATA_START_ROW.
+    """
+    # strings_to_urls=False: teks yang mirip URL (mailto:, http://) ditulis apa adanya, sama seperti openpyxl
+    wb = xlsxwriter.Workbook(out_path, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd h:mm:ss",
+        "strings_to_urls": False,
+    })
+    ws = wb.add_worksheet(layout["title"])
+
+    # Lebar di file xlsx sudah termasuk padding; set_column akan menambah padding lagi,
+    # jadi set lewat pixel (1 karakter = 7px di font default) supaya lebarnya sama persis.
+    formats = [wb.add_format(props) for props in layout["styles"]]
+    for first, last, width, idx in layout["widths"]:
+        ws.set_column_pixels(first, last, width * 7 if width else None, formats[idx] if idx is not None else None)
+    for r, (height, idx) in layout["heights"].items():
+        ws.set_row(r, height, formats[idx] if idx is not None else None)
+
+    for r, c, value, idx in layout["cells"]:
+        ws.write(r, c, value, formats[idx] if idx is not None else None)
+
+    for r, row in enumerate(rows, start=TEMPLATE_DATA_START_ROW - 1):
+        if ws.write_row(r, 0, row):
+            # write_row berhenti di sel pertama yang error (mis. teks > 32767 karakter dipotong),
+            # jadi tulis ulang per sel supaya sisa baris tetap masuk
+            for c, value in enumerate(row):
+                error = ws.write(r, c, value)
+                if error:
+                    logger.warning("Sel baris %d kolom %d tidak tertulis utuh (kode %d)", r + 1, c + 1, error)
+    wb.close()
+
+def extract_no_faktur_from_description(desc: pd.Series) -> pd.Series:
+    """
+    Ambil No Faktur dari kolom Description (vectorized, satu kolom sekaligus).
+    "slash ke-2" = bagian setelah slash pertama; kosong / tanpa slash -> <NA>.
+    """
+    parts = desc.astype(KEY_DTYPE).str.split("/", n=2)
+    key = parts.str[1].astype(KEY_DTYPE).str.strip()
+    return key.mask(key.eq(""))
+
+
+_RE_NON_ALNUM = re.compile(r"[^A-Z0-9]+")
+_RE_MULTI_UNDERSCORE = re.compile(r"_+")
+
+# Kolom K3 yang dipakai (nama persis seperti di file K3); kolom lain tidak ikut dibaca
+K3_COLUMNS = {
+    "Account No.", "Account Name", "Date", "Voucher Category", "Voucher No.", "Description",
+    "Debit Amount", "Credit Amount", "Direction", "Balance",
+}
+
+# Kolom Coretax yang dipakai (nama setelah normalisasi); kolom lain tidak ikut dibaca
+CORETAX_COLUMNS = {
+    "NO_VOUCHER", "DOC_NO",
+    "DPP", "PPN", "AMOUNT_BEF_TAX", "TAX_AMOUNT",
+    "CUSTOMER_NAME", "NAMA_PEMBELI", "DEPT",
+    "NO_FP_MODIF",
+}
+
+def _clean_column_name(col) -> str:
+    col = str(col).strip().upper()
+    col = _RE_NON_ALNUM.sub("_", col)
+    col = _RE_MULTI_UNDERSCORE.sub("_", col).strip("_")
+    return col
 
 def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Normalisasi nama kolom: uppercase, spasi/punctuation -> underscore, rapihin underscore.
     Contoh: 'No Voucher' -> 'NO_VOUCHER'
+    Catatan: label kolom `df` diganti in-place (tanpa copy data), df yang sama dikembalikan.
+    """
+    df.columns = df.columns.map(_clean_column_name)
+    return df
+
+def _read_k3(path: str) -> pd.DataFrame:
+    """Baca file K3 General Ledger, hanya kolom yang ada di K3_COLUMNS."""
+    return pd.read_excel(path, header=1, engine=EXCEL_ENGINE, usecols=lambda c: c in K3_COLUMNS)
+
+def _read_coretax(path: str) -> pd.DataFrame:
+    """Baca file Coretax, hanya kolom yang ada di CORETAX_COLUMNS."""
+    return pd.read_excel(
+        path,
+        header=1,
+        engine=EXCEL_ENGINE,
+        usecols=lambda c: _clean_column_name(c) in CORETAX_COLUMNS,
+    )
+
+def _evict_input_cache():
+    """
+    Hapus file cache yang tidak dipakai lebih dari INPUT_CACHE_MAX_AGE detik (mtime),
+    lalu yang paling lama dipakai kalau jumlahnya masih > INPUT_CACHE_MAX_FILES.
+    """
+    if not os.path.isdir(INPUT_CACHE_DIR):
+        return
+    with os.scandir(INPUT_CACHE_DIR) as it:
+        entries = sorted(
+            ((e.stat().st_mtime, e.path) for e in it if e.is_file(follow_symlinks=False)),
+            reverse=True,
+        )
+    expire_before = time.time() - INPUT_CACHE_MAX_AGE
+    for i, (mtime, path) in enumerate(entries):
+        if i >= INPUT_CACHE_MAX_FILES or mtime < expire_before:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+# Bersihkan cache kedaluwarsa saat app start (bisa saja app mati lebih lama dari INPUT_CACHE_MAX_AGE)
+_evict_input_cache()
+
+def _cached_read(path: str, kind: str, reader) -> pd.DataFrame:
     """
-    def clean(col):
-        col = str(col).strip().upper()
-        col = re.sub(r"[^A-Z0-9]+", "_", col)
-        col = re.sub(r"_+", "_", col).strip("_")
-        return col
-
-    df = df.copy()
-    df.columns = [clean(c) for c in df.columns]
+    Baca file input lewat cache di disk, key = sha1 isi file + jenis ("k3"/"coretax")
+    + versi cara baca (INPUT_CACHE_VERSION, EXCEL_ENGINE, K3_COLUMNS, CORETAX_COLUMNS).
+    Pakai pickle (bukan parquet) karena kolom angka Coretax bisa campuran int & string
+    ("86.226.897"), dan _parse_id_series butuh tipe aslinya.
+    """
+    h = hashlib.sha1(repr((
+        INPUT_CACHE_VERSION, EXCEL_ENGINE, sorted(K3_COLUMNS), sorted(CORETAX_COLUMNS),
+    )).encode())
+    with open(path, "rb") as f:
+        h.update(f.read())
+    digest = h.hexdigest()
+    cache_path = os.path.join(INPUT_CACHE_DIR, f"{kind}_{digest}.pkl")
+
+    _evict_input_cache()  # cache kedaluwarsa tidak boleh kepakai
+    if os.path.exists(cache_path):
+        try:
+            df = pd.read_pickle(cache_path)
+            os.utime(cache_path)  # tandai baru dipakai untuk eviction
+            return df
+        except Exception as e:
+            logger.warning("Cache %s tidak bisa dibaca, parse ulang: %s", cache_path, e)
+
+    df = reader(path)
+    try:
+        os.makedirs(INPUT_CACHE_DIR, exist_ok=True)
+        # Tulis ke file sementara dulu supaya request lain tidak membaca file setengah jadi
+        tmp_path = f"{cache_path}.{os.getpid()}.{id(df)}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+        _evict_input_cache()
+    except OSError as e:
+        logger.warning("Gagal menulis cache %s: %s", cache_path, e)
     return df
 
 def _parse_id_number(x):
@@ -80,21 +372,79 @@ def _parse_id_number(x):
     except:
         return np.nan
 
-def calculate_net(row):
-    # Logika perhitungan Net berdasarkan jenis akun
-    if row["Account Name"] in ["Interest Bank Income", "Other Income", "Rental Income", 
-                               "Repair Service Income", "Sales", "Sales Price Protection"]:
-        return row["Debit Amount"] + row["Credit Amount"]
-    elif row["Account Name"] in ["POP Expense", "Promotion Gift", "Sales Return"]:
-        return row["Debit Amount"] - row["Credit Amount"]
-    else:
-        return 0  # Jika akun tidak dikenali, set nilai default 0
-    
+def _parse_id_series(s: pd.Series) -> pd.Series:
+    """
+    Versi vectorized dari _parse_id_number untuk satu kolom penuh.
+    Sel yang sudah numerik dilewatkan apa adanya, sel teks diparse format Indonesia.
+    """
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype(float)
+    if not pd.api.types.is_object_dtype(s) and not pd.api.types.is_string_dtype(s):
+        return s.apply(_parse_id_number)
+
+    # .str menghasilkan NaN untuk sel non-teks (angka), jadi keduanya bisa dipisah
+    try:
+        text = s.str.strip().str.replace(" ", "", regex=False)
+    except AttributeError:
+        # Kolom object tanpa sel teks (mis. isinya jam + kosong) tidak bisa lewat .str
+        return s.apply(_parse_id_number).astype(float)
+    text = text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    # handle (123) -> -123
+    neg = text.str.startswith("(") & text.str.endswith(")")
+    neg = neg.fillna(False).astype(bool)
+    text = text.where(~neg, text.str[1:-1])
+
+    v = pd.to_numeric(text, errors="coerce").astype(float)
+    v = v.mask(neg, -v)
+    is_text = text.notna()
+    numbers = pd.to_numeric(s.where(~is_text), errors="coerce").astype(float)
+    return v.where(is_text, numbers)
+
+def _join_unique_per_key(df: pd.DataFrame, key: str, col: str) -> pd.Series:
+    """
+    Gabung nilai unik `col` per `key` jadi satu string "a; b" (urut alfabet).
+    Dipakai untuk kolom dengan sedikit nilai unik (FP_STATUS cuma 2), jadi tiap key cukup
+    diwakili bitmask nilai yang muncul; tiap bitmask yang berbeda di-join sekali saja.
+    """
+    pairs = df[[key, col]].dropna()
+    key_codes, keys = pd.factorize(pairs[key])
+    val_codes, vals = pd.factorize(pairs[col], sort=True)
+    vals = np.asarray(vals, dtype=object)
+
+    masks = np.zeros(len(keys), dtype=np.int64)
+    for bit in range(len(vals)):
+        masks[key_codes[val_codes == bit]] |= 1 << bit
+
+    uniq_masks, inverse = np.unique(masks, return_inverse=True)
+    bits = np.arange(len(vals))
+    labels = np.array(["; ".join(vals[(m >> bits) & 1 == 1]) for m in uniq_masks], dtype=object)
+    return pd.Series(labels[inverse], index=keys, dtype=object)
+
+# Akun yang Net-nya Debit + Credit / Debit - Credit; akun lain Net = 0
+NET_ADD_ACCOUNTS = ["Interest Bank Income", "Other Income", "Rental Income",
+                    "Repair Service Income", "Sales", "Sales Price Protection"]
+NET_SUBTRACT_ACCOUNTS = ["POP Expense", "Promotion Gift", "Sales Return"]
+
+def calculate_net(df: pd.DataFrame) -> np.ndarray:
+    # Logika perhitungan Net berdasarkan jenis akun (vectorized, sekali jalan untuk semua baris)
+    account = df["Account Name"]
+    debit = df["Debit Amount"].to_numpy()
+    credit = df["Credit Amount"].to_numpy()
+    return np.select(
+        [account.isin(NET_ADD_ACCOUNTS).to_numpy(), account.isin(NET_SUBTRACT_ACCOUNTS).to_numpy()],
+        [debit + credit, debit - credit],
+        default=0,  # Jika akun tidak dikenali, set nilai default 0
+    )
+
 def compare_files(k3_path: str, coretax_path_1: str, coretax_path_2: str, output_dir: str) -> str:
-    # 1) Read files
-    k3 = pd.read_excel(k3_path, header=1)
-    coretax_1 = pd.read_excel(coretax_path_1, header=1)  # FP Digunggung
-    coretax_2 = pd.read_excel(coretax_path_2, header=1)  # FP Tidak Digunggung
+    # 1) Read files (tiga file independen, dibaca paralel)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        k3_future = executor.submit(_cached_read, k3_path, "k3", _read_k3)
+        coretax_1_future = executor.submit(_cached_read, coretax_path_1, "coretax", _read_coretax)  # FP Digunggung
+        coretax_2_future = executor.submit(_cached_read, coretax_path_2, "coretax", _read_coretax)  # FP Tidak Digunggung
+        k3 = k3_future.result()
+        coretax_1 = coretax_1_future.result()
+        coretax_2 = coretax_2_future.result()
 
     # 2) Normalize columns for Coretax (biar NO VOUCHER / DOC_NO kebaca konsisten)
     coretax_1 = _normalize_columns(coretax_1)
@@ -144,158 +494,124 @@ def compare_files(k3_path: str, coretax_path_1: str, coretax_path_2: str, output
         coretax_1["CUSTOMER"] = None
 
     coretax_1["FP_STATUS"] = "FP Digunggung"
+    # NO_FP_MODIF cuma diambil dari Coretax Tidak Digunggung
+    coretax_1["NO_FP_MODIF"] = None
 
     # 4) Bersihin key + convert angka
     for df in (coretax_1, coretax_2):
-        df["NO_VOUCHER"] = df["NO_VOUCHER"].astype(str).str.strip()
+        df["NO_VOUCHER"] = df["NO_VOUCHER"].astype(KEY_DTYPE).str.strip()
         if "DPP" in df.columns:
-            df["DPP"] = df["DPP"].apply(_parse_id_number)
+            df["DPP"] = _parse_id_series(df["DPP"])
         else:
             df["DPP"] = 0.0
         if "PPN" in df.columns:
-            df["PPN"] = df["PPN"].apply(_parse_id_number)
+            df["PPN"] = _parse_id_series(df["PPN"])
         else:
             df["PPN"] = 0.0
 
     # 5) Combine Coretax (ambil kolom penting aja)
-    keep_cols_1 = [c for c in ["NO_VOUCHER", "VOUCHER_NO", "DPP", "PPN", "CUSTOMER", "FP_STATUS"] if c in coretax_1.columns]
-    keep_cols_2 = [c for c in ["NO_VOUCHER", "VOUCHER_NO", "DPP", "PPN", "CUSTOMER", "FP_STATUS"] if c in coretax_2.columns]
-    coretax_combined = pd.concat([coretax_1[keep_cols_1], coretax_2[keep_cols_2]], ignore_index=True)
-
-    # 6) kalau NO_VOUCHER muncul beberapa kali, DPP/PPN dijumlah, CUSTOMER diambil first non-null, status digabung unik
-    def join_unique(series):
-        vals = [v for v in series.dropna().astype(str).tolist() if v.strip()]
-        return "; ".join(sorted(set(vals))) if vals else None
+    # Dua frame disamakan dulu ke kolom yang sama (yang tidak ada -> NaN), lalu concat sekali
+    keep_cols = ["NO_VOUCHER", "DPP", "PPN", "CUSTOMER", "FP_STATUS", "NO_FP_MODIF"]
+    coretax_combined = pd.concat(
+        [coretax_1.reindex(columns=keep_cols), coretax_2.reindex(columns=keep_cols)],
+        ignore_index=True,
+        sort=False,
+    )
 
+    # 6) kalau NO_VOUCHER muncul beberapa kali, DPP/PPN dijumlah, CUSTOMER/NO_FP_MODIF diambil first non-null, status digabung unik
     agg_map = {
         "DPP": "sum",
         "PPN": "sum",
         "CUSTOMER": "first",
-        "FP_STATUS": join_unique
+        "NO_FP_MODIF": "first",
     }
-    if "VOUCHER_NO" in coretax_combined.columns:
-        agg_map["VOUCHER_NO"] = "first"
 
-    # Aggregate the combined coretax data
-    coretax_agg = coretax_combined.groupby("NO_VOUCHER", as_index=False).agg(agg_map)
+    # Aggregate the combined coretax data (kolom numerik/first lewat jalur Cython, tanpa sort key)
+    coretax_agg = coretax_combined.groupby("NO_VOUCHER", sort=False, as_index=False).agg(agg_map)
 
-    # 7) Extract no faktur dari Description
-    k3["No Faktur (key)"] = k3["Description"].apply(extract_no_faktur_from_description)
-    k3["No Faktur (key)"] = k3["No Faktur (key)"].astype(str).str.strip()
+    # Status digabung unik per voucher (tanpa UDF per grup)
+    fp_status = _join_unique_per_key(coretax_combined, "NO_VOUCHER", "FP_STATUS")
+    coretax_agg["FP_STATUS"] = coretax_agg["NO_VOUCHER"].map(fp_status)
 
-    # 8) Debugging step: Check columns in Coretax_2
-    print("Columns in Coretax_2:", coretax_2.columns)
+    # 7) Extract no faktur dari Description
+    k3["No Faktur (key)"] = extract_no_faktur_from_description(k3["Description"])
 
-    # 9) Debugging: Check if 'NO FP MODIF' exists in coretax_2
-    if "NO FP MODIF" in coretax_2.columns:
-        print("NO FP MODIF exists in Coretax_2.")
-    else:
-        print("NO FP MODIF NOT found in Coretax_2")
+    # 8) Debugging step: Check columns in Coretax_2 (cuma tampil kalau level log DEBUG)
+    logger.debug("Columns in Coretax_2: %s", coretax_2.columns)
+    logger.debug("NO_FP_MODIF ada di Coretax_2: %s", "NO_FP_MODIF" in coretax_2.columns)
 
-    # 10) Merge
+    # 9) Merge
     merged = pd.merge(
         k3,
         coretax_agg,
         left_on="No Faktur (key)",
         right_on="NO_VOUCHER",
         how="left",
-        indicator=True
+        sort=False,
+        validate="many_to_one",
     )
+    # Baris K3 yang tidak ketemu di Coretax (pengganti indicator "_merge")
+    missing = merged["NO_VOUCHER"].isna().to_numpy()
 
-    # 11) Compute Difference based on account type
-    merged["Debit Amount"] = pd.to_numeric(merged["Debit Amount"], errors="coerce").fillna(0)
-    merged["Credit Amount"] = pd.to_numeric(merged["Credit Amount"], errors="coerce").fillna(0)
+    # Sisakan kolom yang masih dipakai (output + bahan hitungan) supaya frame lebih ramping
+    needed_cols = K3_OUTPUT_COLUMNS + ["NO_VOUCHER", "NO_FP_MODIF", "DPP", "PPN", "CUSTOMER", "FP_STATUS"]
+    merged = merged[[c for c in needed_cols if c in merged.columns]].copy()
 
-    # Apply the Net calculation based on the account type
-    merged["Net"] = merged.apply(calculate_net, axis=1)
+    # 10) Compute Difference based on account type
+    # Kolom angka dikonversi sekali di sini (satu pass untuk semua kolom)
+    num_cols = ["Debit Amount", "Credit Amount", "DPP", "PPN"]
+    merged[num_cols] = merged[num_cols].apply(pd.to_numeric, errors="coerce").fillna(0)
 
-    merged["DPP"] = pd.to_numeric(merged["DPP"], errors="coerce").fillna(0)
-    merged["PPN"] = pd.to_numeric(merged["PPN"], errors="coerce").fillna(0)
+    # Net calculation based on the account type
+    merged["Net"] = calculate_net(merged)
 
     # Calculate the Difference based on Net - DPP for "Digunggung" type
-    merged["Difference"] = merged["Net"] - merged["DPP"]
-    
+    merged["Difference"] = merged["Net"].to_numpy() - merged["DPP"].to_numpy()
 
-    # 12) Keterangan + Customer (langsung dari kolom kanonik)
-    merged["Keterangan (Digunggung/Tidak Digunngung)"] = merged["FP_STATUS"]
-    merged.loc[merged["_merge"] != "both", "Keterangan (Digunggung/Tidak Digunngung)"] = "Tidak ada di Coretax"
 
-    merged["Customer"] = merged["CUSTOMER"]
-    merged.loc[merged["_merge"] != "both", "Customer"] = None
-
-    # Debugging: Check if 'NO_FP_MODIF' exists in coretax_2
-    print("Cek apakah 'NO_FP_MODIF' ada di coretax_2:", "NO_FP_MODIF" in coretax_2.columns)
-    if "NO_FP_MODIF" in coretax_2.columns:
-        print(coretax_2["NO_FP_MODIF"].head())  # Menampilkan beberapa nilai untuk memastikan kolom ada
-    else:
-        print("Kolom 'NO_FP_MODIF' tidak ditemukan di Coretax_2")
-
-    print("Setelah merge, kolom di merged:", merged.columns)
-
-    # Jika kolom 'NO_FP_MODIF' ada di coretax_2, tambahkan ke merged
-    if "NO_FP_MODIF" in coretax_2.columns:
-        merged = pd.merge(
-            merged,
-            coretax_2[["NO_VOUCHER", "NO_FP_MODIF"]],
-            left_on="No Faktur (key)",
-            right_on="NO_VOUCHER",
-            how="left",
-            suffixes=("", "_from_coretax2")
-        )
-        print("Setelah merge NO_FP_MODIF, kolom di merged:", merged.columns)
-    else:
-        merged["NO_FP_MODIF"] = None  # Atur sebagai None jika kolom tidak ada
+    # 11) Keterangan + Customer (langsung dari kolom kanonik)
+    merged["Keterangan (Digunggung/Tidak Digunngung)"] = np.where(
+        missing, "Tidak ada di Coretax", merged["FP_STATUS"].to_numpy(dtype=object)
+    )
+    merged["Customer"] = np.where(missing, None, merged["CUSTOMER"].to_numpy(dtype=object))
 
-    # 13) Before filling NaN, convert categorical columns to string type
-    for column in merged.columns:
-        if merged[column].dtype.name == 'category':  # Check if the column is categorical
-            merged[column] = merged[column].astype(str)
-    # Now, proceed with other operations
-    merged.fillna("-", inplace=True)
+    logger.debug("Setelah merge, kolom di merged: %s", merged.columns)
 
-    # 14) Write ke template
+    # 12) Write ke template
     if not os.path.exists(DRAFT_TEMPLATE_PATH):
         raise FileNotFoundError("Draft Output.xlsx tidak ditemukan. Taruh file itu 1 folder dengan app.py")
 
-    wb = load_workbook(DRAFT_TEMPLATE_PATH)
-    ws = wb.active
-
-    start_row = 5
-    max_row = ws.max_row
-    for r in range(start_row, max_row + 1):
-        for c in range(1, 19):
-            ws.cell(r, c).value = None
-
-    for i in range(len(merged)):
-        r = start_row + i
-        row = merged.iloc[i]
-
-        # Left (K3)
-        ws.cell(r, 1).value = row.get("Account No.")
-        ws.cell(r, 2).value = row.get("Account Name")
-        ws.cell(r, 3).value = row.get("Date")
-        ws.cell(r, 4).value = row.get("Voucher Category")
-        ws.cell(r, 5).value = row.get("Voucher No.")
-        ws.cell(r, 6).value = row.get("Description")
-        ws.cell(r, 7).value = row.get("Debit Amount")
-        ws.cell(r, 8).value = row.get("Credit Amount")
-        ws.cell(r, 9).value = row.get("Net")  # Displaying Net
-        ws.cell(r, 10).value = row.get("Direction")
-        ws.cell(r, 11).value = row.get("Balance")
-
-        # Right (Coretax)
-        ws.cell(r, 13).value = row.get("NO_VOUCHER")  # No Faktur from Coretax
-        ws.cell(r, 14).value = row.get("NO_FP_MODIF")  # Voucher No. from NO FP MODIF
-        ws.cell(r, 15).value = row.get("DPP")
-        ws.cell(r, 16).value = row.get("PPN")
-        ws.cell(r, 17).value = row.get("Difference")
-        ws.cell(r, 18).value = row.get("Customer")
-        ws.cell(r, 19).value = row.get("Keterangan (Digunggung/Tidak Digunngung)")
+    layout = _template_layout(os.path.getmtime(DRAFT_TEMPLATE_PATH))
+
+    # Ambil tiap kolom output sekali sebagai array object, lalu zip jadi baris.
+    # Nilai kosong: kolom teks -> "-", kolom angka -> cell kosong (tetap numerik di Excel).
+    # Kolom L (ke-12) dibiarkan kosong sebagai pemisah.
+    output = merged.reindex(columns=K3_OUTPUT_COLUMNS + CORETAX_OUTPUT_COLUMNS)
+    columns = []
+    for column in output.columns:
+        values = output[column].to_numpy(dtype=object)
+        empty = None if column in NUMERIC_OUTPUT_COLUMNS else "-"
+        columns.append(np.where(pd.isna(values), empty, values))
+
+    # Salinan ringan untuk halaman /comparison (tanpa kolom pemisah), nama kolom = header template.
+    # Kolom teks disimpan sebagai string karena isinya bisa campuran tipe, sedangkan Arrow
+    # butuh 1 tipe per kolom.
+    preview = pd.DataFrame({
+        label: pd.to_numeric(values, errors="coerce") if column in NUMERIC_OUTPUT_COLUMNS
+        else values.astype(str)
+        for label, column, values in zip(_output_header_labels(layout), output.columns, columns)
+    })
+    columns.insert(len(K3_OUTPUT_COLUMNS), np.full(len(output), None, dtype=object))
 
     os.makedirs(output_dir, exist_ok=True)
     out_name = f"Draft_Updated_Output_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     out_path = os.path.join(output_dir, out_name)
-    wb.save(out_path)
+    _write_draft_output(out_path, layout, zip(*columns))
+    try:
+        preview.to_feather(_comparison_preview_path(out_path))
+    except Exception as e:
+        # Tidak fatal: show_comparison akan baca xlsx-nya langsung
+        logger.warning("Gagal menulis preview %s: %s", out_path, e)
     return out_path
 
 # Fungsi untuk menghapus file output
@@ -304,13 +620,13 @@ def delete_output_files(output_dir):
         # Cek jika direktori output ada
         if os.path.exists(output_dir):
             # Hapus semua file dalam folder output
-            for filename in os.listdir(output_dir):
-                file_path = os.path.join(output_dir, filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)  # Hapus file
-                    print(f"File deleted: {file_path}")
+            with os.scandir(output_dir) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        os.unlink(entry.path)  # Hapus file
+                        logger.debug("File deleted: %s", entry.path)
     except Exception as e:
-        print(f"Error deleting files: {e}")
+        logger.error("Error deleting files: %s", e)
 
 # Homepage route to upload files
 @app.route('/')
@@ -362,14 +678,39 @@ def upload_file():
     return 'Invalid file type'
 
 
+def _comparison_preview_path(out_path: str) -> str:
+    """Path file feather yang ditulis compare_files di sebelah file output xlsx."""
+    return os.path.splitext(out_path)[0] + ".feather"
+
+@lru_cache(maxsize=8)
+def _read_comparison(path: str, mtime: float) -> pd.DataFrame:
+    # Hasil parse file output di-cache per (path, mtime).
+    # Pakai preview feather kalau ada; file output lama (tanpa preview) tetap dibaca dari xlsx.
+    preview_path = _comparison_preview_path(path)
+    if os.path.exists(preview_path):
+        return pd.read_feather(preview_path)
+    # Header diambil dari baris ke-4 template (sama seperti preview), kolom pemisah dibuang
+    df = pd.read_excel(path, header=TEMPLATE_DATA_START_ROW - 2, engine=EXCEL_ENGINE)
+    if len(df.columns) > len(K3_OUTPUT_COLUMNS):
+        df = df.drop(columns=df.columns[len(K3_OUTPUT_COLUMNS)])
+    return df
+
+def _display_value(value):
+    """Format 1 sel untuk tabel /comparison."""
+    if pd.isna(value):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
 @app.route('/comparison', methods=['GET'])
 def show_comparison():
     updated_file = request.args.get('updated_file')
     page = request.args.get('page', 1, type=int)  # Default to 1 if 'page' is not in the URL
     rows_per_page = 6
 
-    # Read the updated file for comparison
-    merged_df = pd.read_excel(updated_file)
+    # Read the updated file for comparison (cached, jadi pindah halaman tidak parse ulang xlsx)
+    merged_df = _read_comparison(updated_file, os.path.getmtime(updated_file))
 
     # Pagination Logic
     total_pages = (len(merged_df) // rows_per_page) + (1 if len(merged_df) % rows_per_page != 0 else 0)
@@ -377,12 +718,14 @@ def show_comparison():
     end_row = start_row + rows_per_page
     page_data = merged_df[start_row:end_row]
 
-    table_html = page_data.to_html(classes='table table-striped')
+    # Nilai sel diformat di sini (angka bulat tanpa ".0", NaN jadi kosong), tabelnya dirender Jinja
+    columns = list(page_data.columns)
+    rows = [tuple(_display_value(v) for v in row) for row in page_data.itertuples(index=False, name=None)]
 
-    # Pagination controls (Previous/Next buttons)
-    pagination_html = ""
+    # Pagination controls (Previous/Next buttons), dirender di template
+    pagination = []
     if page > 1:
-        pagination_html += f'<a href="/comparison?updated_file={updated_file}&page={page-1}" class="btn btn-secondary">Previous</a>'
+        pagination.append({"label": "Previous", "page": page - 1, "current": False})
 
     # Display numbers for pagination, limit to a range of 5 numbers
     # Ensure that the pagination numbers are in a range that doesn't exceed the total pages
@@ -390,16 +733,13 @@ def show_comparison():
     pagination_end = min(total_pages, pagination_start + 4)  # End at 5 pages from the starting page
 
     for p in range(pagination_start, pagination_end + 1):
-        if p == page:
-            pagination_html += f' <span class="btn btn-light disabled">{p}</span>'
-        else:
-            pagination_html += f' <a href="/comparison?updated_file={updated_file}&page={p}" class="btn btn-secondary">{p}</a>'
+        pagination.append({"label": p, "page": p, "current": p == page})
 
     if page < total_pages:
-        pagination_html += f' <a href="/comparison?updated_file={updated_file}&page={page+1}" class="btn btn-secondary">Next</a>'
+        pagination.append({"label": "Next", "page": page + 1, "current": False})
 
     # Return the table with pagination controls, passing `page` to the template
-    return render_template('comparison.html', table_html=table_html, pagination_html=pagination_html, updated_file=updated_file, page=page)
+    return render_template('comparison.html', columns=columns, rows=rows, pagination=pagination, updated_file=updated_file, page=page)
 
 
 @app.route('/download/<filename>')
@@ -417,13 +757,13 @@ def delete_all_uploaded_files():
         # Cek jika direktori upload ada
         if os.path.exists(app.config['UPLOAD_FOLDER']):
             # Hapus semua file dalam folder upload
-            for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)  # Hapus file
-                    print(f"Uploaded file deleted: {file_path}")
+            with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        os.unlink(entry.path)  # Hapus file
+                        logger.debug("Uploaded file deleted: %s", entry.path)
     except Exception as e:
-        print(f"Error deleting uploaded files: {e}")
+        logger.error("Error deleting uploaded files: %s", e)
 
 if __name__ == "__main__":
     app.run(debug=False)